@@ -1,5 +1,5 @@
 """Daikin Skyport integration."""
-import os
+import threading
 from datetime import timedelta
 
 import voluptuous as vol
@@ -9,22 +9,37 @@ from homeassistant.helpers import discovery
 from homeassistant.const import (
     CONF_PASSWORD,
     CONF_EMAIL,
+    EVENT_HOMEASSISTANT_STOP,
 )
-from homeassistant.util import Throttle
-from homeassistant.helpers.json import save_json
+from homeassistant.helpers.storage import Store
+from homeassistant.util import Throttle, slugify
 
-from .daikinskyport import DaikinSkyport
+from .daikinskyport import DaikinSkyport, PRIORITY_CONFIRM, PRIORITY_POLL
+from .tokenstore import FileTokenStore, HomeAssistantTokenStore
 from .const import (
     _LOGGER,
     DOMAIN,
+    SNAPSHOT_KEYS,
+    SNAPSHOT_PREFIXES,
 )
 
 CONF_HOLD_TEMP = "hold_temp"
+CONF_HTTP2 = "http2"
+CONF_MAX_STALENESS = "max_staleness"
+CONF_COMPACT_SNAPSHOTS = "compact_snapshots"
 
 DAIKINSKYPORT_CONFIG_FILE = "daikinskyport.conf"
 
+# Tokens are kept in .storage, one file per account.
+STORAGE_VERSION = 1
+STORAGE_KEY = DOMAIN + ".{}"
+
 MIN_TIME_BETWEEN_UPDATES = timedelta(seconds=30)
 
+# Entities are answered from a snapshot up to this old (seconds) while a
+# fresh one is fetched in the background.
+DEFAULT_MAX_STALENESS = 120
+
 NETWORK = None
 
 CONFIG_SCHEMA = vol.Schema(
@@ -34,6 +49,9 @@ CONFIG_SCHEMA = vol.Schema(
                 vol.Optional(CONF_EMAIL): cv.string,
                 vol.Optional(CONF_PASSWORD): cv.string,
                 vol.Optional(CONF_HOLD_TEMP, default=False): cv.boolean,
+                vol.Optional(CONF_HTTP2, default=False): cv.boolean,
+                vol.Optional(CONF_MAX_STALENESS, default=DEFAULT_MAX_STALENESS): cv.positive_int,
+                vol.Optional(CONF_COMPACT_SNAPSHOTS, default=False): cv.boolean,
             }
         )
     },
@@ -43,17 +61,69 @@ CONFIG_SCHEMA = vol.Schema(
 class DaikinSkyportData:
     """Get the latest data and update the states."""
 
-    def __init__(self, config_file):
+    def __init__(self, hass, token_store, http2=False, max_staleness=DEFAULT_MAX_STALENESS,
+                 compact_snapshots=False):
         """Init the Daikin Skyport data object."""
 
-        self.daikinskyport = DaikinSkyport(config_file)
+        self.hass = hass
+        self.daikinskyport = DaikinSkyport(token_store=token_store, bootstrap=False, http2=http2)
+        if compact_snapshots:
+            self.daikinskyport.register_projection(SNAPSHOT_KEYS, SNAPSHOT_PREFIXES)
+        self.max_staleness = max_staleness
+        self.ready_devices = []
+        self.device_listeners = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Log in and fetch the thermostats without blocking startup."""
+        self.daikinskyport.start_bootstrap(self.device_arrived)
+
+    def device_arrived(self, index):
+        """Hand a newly fetched thermostat over to Home Assistant."""
+        self.hass.add_job(self.device_ready, index)
+
+    def device_ready(self, index):
+        """Notify the platforms that a thermostat has data."""
+        with self.lock:
+            self.ready_devices.append(index)
+            listeners = list(self.device_listeners)
+        for listener in listeners:
+            listener(index)
+
+    def add_device_listener(self, listener):
+        """Call listener(index) for every thermostat, now and as they arrive."""
+        with self.lock:
+            self.device_listeners.append(listener)
+            ready = list(self.ready_devices)
+        for index in ready:
+            listener(index)
 
     @Throttle(MIN_TIME_BETWEEN_UPDATES)
-    def update(self):
+    def update(self, priority=PRIORITY_POLL):
         """Get the latest data from daikinskyport."""
-        self.daikinskyport.update()
+        # A refresh confirming a command must see the new state, not a cached one.
+        max_staleness = None if priority == PRIORITY_CONFIRM else self.max_staleness
+        self.daikinskyport.update(priority, max_staleness)
         _LOGGER.debug("Daikin Skyport data updated successfully")
 
+    def confirm(self, index):
+        """Re-read one thermostat to confirm a command sent to it."""
+        self.daikinskyport.refresh_thermostat(index)
+
+    def data_age(self, deviceid):
+        """Return the age in seconds of the data shown for a thermostat."""
+        age = self.daikinskyport.data_age(deviceid)
+        if age is None:
+            return None
+        return round(age)
+
+    def update_failures(self, deviceid):
+        """Return how many updates in a row failed for a thermostat."""
+        status = self.daikinskyport.device_status().get(deviceid)
+        if status is None:
+            return 0
+        return status["failures"]
+
 
 def setup(hass, config):
     """Set up the Daikin Skyport Thermostat.
@@ -62,15 +132,27 @@ def setup(hass, config):
     devices discovered on the network.
     """
 
-    # Create daikinskyport.conf if it doesn't exist
-    if not os.path.isfile(hass.config.path(DAIKINSKYPORT_CONFIG_FILE)):
-        jsonconfig = {"EMAIL": config[DOMAIN].get(CONF_EMAIL),
-                      "PASSWORD": config[DOMAIN].get(CONF_PASSWORD)
-                      }
-        save_json(hass.config.path(DAIKINSKYPORT_CONFIG_FILE), jsonconfig)
-
-    data = DaikinSkyportData(hass.config.path(DAIKINSKYPORT_CONFIG_FILE))
+    email = config[DOMAIN].get(CONF_EMAIL)
+    credentials = {"EMAIL": email, "PASSWORD": config[DOMAIN].get(CONF_PASSWORD)}
+    # Tokens from daikinskyport.conf are picked up until the account has
+    # saved tokens of its own.
+    token_store = HomeAssistantTokenStore(
+        Store(hass, STORAGE_VERSION, STORAGE_KEY.format(slugify(email or "default"))),
+        hass.loop,
+        {key: value for key, value in credentials.items() if value is not None},
+        FileTokenStore(hass.config.path(DAIKINSKYPORT_CONFIG_FILE)))
+
+    data = DaikinSkyportData(hass, token_store,
+                             http2=config[DOMAIN].get(CONF_HTTP2),
+                             max_staleness=config[DOMAIN].get(CONF_MAX_STALENESS),
+                             compact_snapshots=config[DOMAIN].get(CONF_COMPACT_SNAPSHOTS))
     hass.data[DOMAIN] = data
+
+    def close_daikinskyport(event):
+        """Close the Daikin Skyport connection pool."""
+        data.daikinskyport.close()
+
+    hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, close_daikinskyport)
     
     hold_temp = config[DOMAIN].get(CONF_HOLD_TEMP)
 
@@ -78,5 +160,8 @@ def setup(hass, config):
     discovery.load_platform(hass, "sensor", DOMAIN, {}, config)
 #    discovery.load_platform(hass, "binary_sensor", DOMAIN, {}, config)
     discovery.load_platform(hass, "weather", DOMAIN, {}, config)
+
+    # Entities are added by each platform as their thermostat's data arrives.
+    data.start()
     
     return True
@@ -52,6 +52,7 @@ from .const import (
     DAIKIN_HVAC_MODE_AUTO,
     DAIKIN_HVAC_MODE_AUXHEAT,
 )
+from .daikinskyport import RESUME_PROGRAM_BODY
 
 WEEKDAY = [ "Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 
@@ -215,11 +216,15 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         return
     data = hass.data[DOMAIN]
     
-    devices = [
-        Thermostat(data, index)
-        for index in range(len(data.daikinskyport.thermostats))
-    ]
-    add_entities(devices)
+    devices = []
+
+    def add_thermostat(index):
+        """Add the climate entity for a thermostat once its data has arrived."""
+        thermostat = Thermostat(data, index)
+        devices.append(thermostat)
+        add_entities([thermostat])
+
+    data.add_device_listener(add_thermostat)
 
     def resume_program_set_service(service):
         """Resume the schedule on the target thermostats."""
@@ -232,9 +237,13 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         else:
             target_thermostats = devices
 
+        # One concurrent round of PUTs instead of one request per thermostat.
+        data.daikinskyport.bulk_update(
+            {thermostat.thermostat_index: RESUME_PROGRAM_BODY
+             for thermostat in target_thermostats},
+            "resume program")
         for thermostat in target_thermostats:
-            thermostat.resume_program()
-
+            thermostat.update_without_throttle = True
             thermostat.schedule_update_ha_state(True)
 
     def set_fan_schedule_service(service):
@@ -400,7 +409,7 @@ class Thermostat(ClimateEntity):
         """Get the latest state from the thermostat."""
         if self.update_without_throttle:
             sleep(3)
-            self.data.update(no_throttle=True)
+            self.data.confirm(self.thermostat_index)
             self.update_without_throttle = False
         else:
             self.data.update()
@@ -533,7 +542,9 @@ class Thermostat(ClimateEntity):
             "humidification_demand": round(self.thermostat["ctAHHumidificationRequestedDemand"] / 2, 1),
             "thermostat_version": self.thermostat["statFirmware"],
             "night_mode_active": self.thermostat["nightModeActive"],
-            "night_mode_enabled": self.thermostat["nightModeEnabled"]
+            "night_mode_enabled": self.thermostat["nightModeEnabled"],
+            "data_age": self.data.data_age(self.thermostat["id"]),
+            "update_failures": self.data.update_failures(self.thermostat["id"]),
         }
 
     @property
@@ -53,3 +53,26 @@ DAIKIN_HVAC_MODE_HEAT = 1
 DAIKIN_HVAC_MODE_COOL = 2
 DAIKIN_HVAC_MODE_AUTO = 3
 DAIKIN_HVAC_MODE_AUXHEAT = 4
+
+# /deviceData keys read by the entities and the set_* defaults.  With
+# compact_snapshots enabled only these are kept from each snapshot.
+SNAPSHOT_KEYS = (
+    "aqIndoorAvailable", "aqIndoorParticlesValue", "aqIndoorVOCValue", "aqIndoorValue",
+    "aqOutdoorAvailable", "aqOutdoorOzone", "aqOutdoorParticles", "aqOutdoorValue",
+    "cspActive", "cspAway", "cspHome", "ctAHCurrentIndoorAirflow",
+    "ctAHFanCurrentDemandStatus", "ctAHHeatRequestedDemand",
+    "ctAHHumidificationRequestedDemand", "ctIFCCoolRequestedDemandPercent",
+    "ctIFCCurrentCoolActualStatus", "ctIFCCurrentFanActualStatus",
+    "ctIFCCurrentHeatActualStatus", "ctIFCDehumRequestedDemandPercent",
+    "ctIFCFanRequestedDemandPercent", "ctIFCHeatRequestedDemandPercent",
+    "ctIFCHumRequestedDemandPercent", "ctIndoorPower", "ctOutdoorCoolRequestedDemand",
+    "ctOutdoorDeHumidificationRequestedDemand", "ctOutdoorFanRequestedDemandPercentage",
+    "ctOutdoorFrequencyInPercent", "ctOutdoorHeatRequestedDemand", "ctOutdoorNoofCoolStages",
+    "ctOutdoorPower", "ctSystemCapHeat", "dehumSP", "equipmentStatus", "fanCirculate",
+    "fanCirculateDuration", "fanCirculateSpeed", "fanCirculateStart", "fanCirculateStop",
+    "geofencingAway", "hspActive", "hspAway", "hspHome", "humIndoor", "humOutdoor", "humSP",
+    "mode", "nightModeActive", "nightModeEnabled", "nightModeStart", "nightModeStop",
+    "statFirmware", "tempIndoor", "tempOutdoor", "timeZone",
+)
+# Key families read by prefix: the weather entity and the schedule service.
+SNAPSHOT_PREFIXES = ("weather", "sched")
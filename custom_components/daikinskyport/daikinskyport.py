@@ -1,60 +1,249 @@
 ''' Python Code for Communication with the Daikin Skyport Thermostat.  This is taken mostly from pyecobee, so much credit to those contributors'''
-import requests
+import asyncio
+import base64
+import hashlib
 import json
-import os
 import logging
-
-from requests.exceptions import RequestException
+import random
+import threading
+import time
+from urllib.parse import urlsplit
 
 from .const import DAIKIN_PERCENT_MULTIPLIER
+from .metrics import NetworkMetrics
+from .policy import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeviceBackoff,
+    LatencyTracker,
+    RequestScheduler,
+    RetryPolicy,
+    SingleFlight,
+    TokenBucket,
+    PRIORITY_CONFIRM,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_POLL,
+)
+from .projection import KeyProjection
+from .tokenstore import FileTokenStore, MemoryTokenStore, config_from_file
+from .transport import AiohttpTransport, HttpxTransport, TransportError
 
 logger = logging.getLogger('daikinskyport')
 
 NEXT_SCHEDULE = 1
 
-def config_from_file(filename, config=None):
-    ''' Small configuration file management function'''
-    if config:
-        # We're writing configuration
-        try:
-            with open(filename, 'w') as fdesc:
-                fdesc.write(json.dumps(config))
-        except IOError as error:
-            logger.exception(error)
-            return False
-        return True
-    else:
-        # We're reading config
-        if os.path.isfile(filename):
-            try:
-                with open(filename, 'r') as fdesc:
-                    return json.loads(fdesc.read())
-            except IOError as error:
-                return False
-        else:
-            return {}
+DAIKIN_API_URL = 'https://api.daikinskyport.com'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_CONCURRENCY = 4
+# In-flight request slots held back from background polling for user commands.
+DEFAULT_RESERVED_SLOTS = 1
+# Most duplicate /deviceData GETs that hedging may send in one poll cycle.
+DEFAULT_MAX_HEDGES = 2
+HEDGE_PERCENTILE = 95
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+# Overall time budget for one get_thermostats cycle, in seconds.  Devices that
+# have not answered by then keep their previous snapshot and are marked stale.
+DEFAULT_CYCLE_DEADLINE = 60
+# Device IDs and names almost never change, so /devices is only re-read this
+# often (seconds), or sooner when a device turns up unknown or missing.
+DEFAULT_DEVICES_TTL = 3600
+# Account-wide request budgets: sustained requests per second and burst size.
+DEFAULT_READ_RATE = 2
+DEFAULT_READ_BURST = 10
+DEFAULT_WRITE_RATE = 1
+DEFAULT_WRITE_BURST = 5
+# bulk_update: PUTs in flight at once, and retries per device after a
+# connection error or 5xx.
+DEFAULT_BULK_PARALLELISM = 4
+DEFAULT_WRITE_RETRIES = 1
+# A write retried after a connection error or 5xx waits about this long
+# (jittered, doubling per retry) before it is sent again.
+WRITE_RETRY_DELAY = 0.5
+# Refresh the access token this many seconds before it expires, and retry a
+# failed early refresh this often until the token runs out.
+DEFAULT_TOKEN_REFRESH_MARGIN = 300
+TOKEN_RETRY_INTERVAL = 30
+# Expiry times decoded from a JWT are moved this many seconds earlier to
+# allow for clock differences with the API servers.
+JWT_CLOCK_SKEW = 30
+# Minimum seconds between two logins, so a refresh token that keeps being
+# rejected cannot turn every poll into a login.
+DEFAULT_LOGIN_COOLDOWN = 60
+# New tokens are written to the config file this many seconds after the last
+# change, so a refresh followed by a login only writes once.
+TOKEN_SAVE_DELAY = 2
+# A failed start-up is retried after this many seconds, doubling up to the
+# maximum, until at least one device has data.
+BOOTSTRAP_RETRY_DELAY = 30
+BOOTSTRAP_MAX_RETRY_DELAY = 600
+# Endpoint names used for retry and I/O accounting.
+ENDPOINT_LOGIN = 'login'
+ENDPOINT_TOKEN = 'token'
+ENDPOINT_DEVICES = 'devices'
+ENDPOINT_DEVICE_DATA = 'deviceData GET'
+ENDPOINT_DEVICE_WRITE = 'deviceData PUT'
+ENDPOINTS = (ENDPOINT_LOGIN, ENDPOINT_TOKEN, ENDPOINT_DEVICES,
+             ENDPOINT_DEVICE_DATA, ENDPOINT_DEVICE_WRITE)
 
+# PUT body that returns a thermostat to its schedule.
+RESUME_PROGRAM_BODY = {"schedEnabled": True,
+                       "schedOverride": 0,
+                       "geofencingAway": False
+                       }
 
-class DaikinSkyport(object):
-    ''' Class for storing Daikin Skyport Thermostats and Sensors '''
+HTTP_OK = 200
+HTTP_NOT_MODIFIED = 304
+HTTP_UNAUTHORIZED = 401
+HTTP_NOT_FOUND = 404
+HTTP_SERVER_ERROR = 500
+
+def token_expiry(token):
+    ''' Unix time from the exp claim of a JWT access token, or None if the
+    token is not a JWT or has no expiry.  The signature is not checked; the
+    result only decides when to refresh. '''
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    payload = parts[1] + '=' * (-len(parts[1]) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict):
+        return None
+    expiry = claims.get('exp')
+    if isinstance(expiry, bool) or not isinstance(expiry, (int, float)):
+        return None
+    return expiry
 
-    def __init__(self, config_filename=None, user_email=None, user_password=None, config=None):
+
+def endpoint_name(method, url):
+    ''' Name of the API endpoint a request goes to, for accounting '''
+    path = urlsplit(url).path
+    if path.endswith('/users/auth/login'):
+        return ENDPOINT_LOGIN
+    if path.endswith('/users/auth/token'):
+        return ENDPOINT_TOKEN
+    if '/deviceData/' in path:
+        return ENDPOINT_DEVICE_DATA if method == 'GET' else ENDPOINT_DEVICE_WRITE
+    if path.endswith('/devices'):
+        return ENDPOINT_DEVICES
+    return path
+
+
+def payload_size(body):
+    ''' Size in bytes of a JSON request body '''
+    if body is None:
+        return 0
+    return len(json.dumps(body).encode('utf-8'))
+
+
+class AsyncDaikinSkyport(object):
+    ''' Asyncio client for storing Daikin Skyport Thermostats and Sensors '''
+
+    def __init__(self, config_filename=None, user_email=None, user_password=None, config=None,
+                 pool_size=DEFAULT_POOL_SIZE, session=None,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, reserved_slots=DEFAULT_RESERVED_SLOTS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 cycle_deadline=DEFAULT_CYCLE_DEADLINE,
+                 read_rate=DEFAULT_READ_RATE, read_burst=DEFAULT_READ_BURST,
+                 write_rate=DEFAULT_WRITE_RATE, write_burst=DEFAULT_WRITE_BURST,
+                 devices_ttl=DEFAULT_DEVICES_TTL, transport=None, http2=False,
+                 hedging=False, max_hedges=DEFAULT_MAX_HEDGES, retry_policy=None,
+                 projection=None, token_refresh_margin=DEFAULT_TOKEN_REFRESH_MARGIN,
+                 login_cooldown=DEFAULT_LOGIN_COOLDOWN, token_store=None):
         self.thermostats = list()
         self.thermostatlist = list()
         self.authenticated = False
+        if transport is None and http2:
+            try:
+                transport = HttpxTransport(pool_size, connect_timeout, read_timeout)
+            except ImportError:
+                logger.warning("httpx is not installed; falling back to HTTP/1.1.")
+        if transport is None:
+            transport = AiohttpTransport(session, pool_size, connect_timeout, read_timeout)
+        self.transport = transport
+        self.device_semaphore = asyncio.Semaphore(max_concurrency)
+        self.scheduler = RequestScheduler(max_concurrency + reserved_slots, reserved_slots)
+        self.cycle_deadline = cycle_deadline
+        # Monotonic time of the last fresh snapshot per device, the devices
+        # whose snapshot was (not) refreshed during the last cycle, the
+        # devices whose last fetch got an error, and the backoff of devices
+        # that keep failing.
+        self.last_updated = dict()
+        self.stale_devices = set()
+        self.fresh_devices = set()
+        self.device_errors = set()
+        self.device_backoff = DeviceBackoff()
+        self.breaker = CircuitBreaker()
+        # GETs draw from the read budget; PUTs and the auth POSTs from the
+        # write budget.
+        self.read_limiter = TokenBucket(read_rate, read_burst)
+        self.write_limiter = TokenBucket(write_rate, write_burst)
+        self.single_flight = SingleFlight()
+        # Bumped by every successful PUT.  Reads are only coalesced within a
+        # generation, and a snapshot fetched in an older generation never
+        # replaces one fetched in a newer one, so a read-after-write always
+        # sees the write.
+        self.write_generation = 0
+        self.snapshot_generation = dict()
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        # Hedging: when a device read runs past the observed p95 latency, a
+        # duplicate is sent and the first answer wins.  Capped per cycle.
+        self.hedging = hedging
+        self.max_hedges = max_hedges
+        self.hedges_left = max_hedges
+        self.hedges_sent = 0
+        self.read_latency = LatencyTracker()
+        self.revalidation = None
+        self.bootstrapping = None
+        # Optional KeyProjection: when set, only its keys are kept from each
+        # decoded /deviceData body.
+        self.projection = projection
+        self.metrics = NetworkMetrics()
+        self.new_device_callback = None
+        self.devices_ttl = devices_ttl
+        self.devices_fetched = None
+        # Per-device ETag/Last-Modified validators and body digests of the
+        # last /deviceData snapshot, used to skip re-decoding unchanged data.
+        self.validators = dict()
+        self.body_hashes = dict()
+        self.access_token = ''
+        self.refresh_token = ''
+        self.user_password = None
+        # Monotonic expiry time of the access token, when the API told us.
+        self.token_expires = None
+        self.token_refresh_margin = token_refresh_margin
+        self.token_refresher = None
+        self.login_cooldown = login_cooldown
+        self.last_login = None
+        self.rejected_refresh_token = None
+        # Tokens last saved to the token store, and the pending debounced save.
+        self.saved_tokens = ('', '')
+        self.token_store = None
+        self.token_save = None
+        self.token_saving = None
+        self.token_save_lock = asyncio.Lock()
 
-        if config is None:
-            self.file_based_config = True
-            if config_filename is None:
-                if (user_email is None) or (user_password is None):
-                    logger.error("Error. No user email or password was supplied.")
-                    return
-                jsonconfig = {"EMAIL": user_email, "PASSWORD": user_password}
-                config_filename = 'daikinskyport.conf'
-                config_from_file(config_filename, jsonconfig)
-            config = config_from_file(config_filename)
-        else:
-            self.file_based_config = False
+        # Without an explicit token store, tokens go to the config file, or
+        # stay in memory when the config was passed in directly.
+        if token_store is None:
+            if config is None:
+                if config_filename is None:
+                    if (user_email is None) or (user_password is None):
+                        logger.error("Error. No user email or password was supplied.")
+                        return
+                    jsonconfig = {"EMAIL": user_email, "PASSWORD": user_password}
+                    config_filename = 'daikinskyport.conf'
+                    config_from_file(config_filename, jsonconfig)
+                token_store = FileTokenStore(config_filename)
+            else:
+                token_store = MemoryTokenStore(config)
+        self.token_store = token_store
+        config = token_store.load()
         if 'EMAIL' in config:
             self.user_email = config['EMAIL']
         else:
@@ -65,117 +254,541 @@ class DaikinSkyport(object):
 
         if 'ACCESS_TOKEN' in config:
             self.access_token = config['ACCESS_TOKEN']
-        else:
-            self.access_token = ''
 
         if 'REFRESH_TOKEN' in config:
             self.refresh_token = config['REFRESH_TOKEN']
+        self.saved_tokens = (self.access_token, self.refresh_token)
+
+    async def bootstrap(self, on_device=None):
+        ''' Start-up sequence: log in only if there is no refresh token, let
+        /devices validate (or refresh) the stored token, then fetch every
+        device's first snapshot concurrently.  on_device(index) is called as
+        soon as each device's data arrives, and again for any device that
+        first shows up in a later cycle. '''
+        self.new_device_callback = on_device
+        if not self.refresh_token and not await self.request_tokens():
+            return None
+        self.retry_policy.new_cycle()
+        if self.access_token and self.token_expires is None:
+            # A stored token: its JWT expiry tells whether it is still good,
+            # without spending a request to find out.
+            self.token_received(None)
+            if self.token_expires is not None and time.monotonic() >= self.token_expires:
+                logger.debug("Stored Daikin Skyport access token has expired; refreshing it.")
+                await self.refresh_tokens()
+        if not await self.fetch_device_list(PRIORITY_INTERACTIVE):
+            return None
+
+        async def first_snapshot(thermostat):
+            generation = self.write_generation
+            thermostat_info = await self.get_thermostat_info(thermostat['id'],
+                                                             PRIORITY_INTERACTIVE)
+            if thermostat_info is not None:
+                self.store_thermostat(thermostat, thermostat_info, generation)
+
+        await asyncio.gather(*(first_snapshot(thermostat) for thermostat in self.thermostatlist))
+        return self.thermostats
+
+    async def bootstrap_until_ready(self, on_device=None):
+        ''' Run bootstrap until at least one device has data (or the account
+        has none), backing off between attempts.  Without it, a cloud outage
+        at start-up would leave no entities and so no update cycle to
+        recover from it. '''
+        self.bootstrapping = asyncio.current_task()
+        delay = BOOTSTRAP_RETRY_DELAY
+        while True:
+            try:
+                if (await self.bootstrap(on_device) is not None and
+                        (self.thermostats or not self.thermostatlist)):
+                    return self.thermostats
+            except Exception:
+                logger.exception("Error while starting Daikin Skyport.")
+            logger.warn("Daikin Skyport start-up failed; retrying in %s seconds.", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BOOTSTRAP_MAX_RETRY_DELAY)
+
+    async def send(self, method, url, headers=None, json=None, priority=PRIORITY_POLL,
+                   prepaid=False, admitted=None):
+        ''' Send one API request through the rate limiter, the priority
+        scheduler and the circuit breaker.  prepaid says the caller has
+        already taken the rate limiter token.  admitted, if given, is a
+        future set once the request has got past all three and goes out.
+        The latency of GETs is recorded from that moment on.
+        Returns a SkyportResponse, or None if the request could not be
+        completed.  Raises CircuitOpenError if the breaker refused it. '''
+        if not prepaid:
+            limiter = self.read_limiter if method == 'GET' else self.write_limiter
+            await limiter.acquire(priority)
+        await self.scheduler.acquire(priority)
+        try:
+            if not self.breaker.allow():
+                logger.debug("Daikin Skyport circuit breaker is open; not sending %s %s",
+                             method, url)
+                raise CircuitOpenError()
+            probe = self.breaker.probing
+            endpoint = endpoint_name(method, url)
+            request_bytes = payload_size(json)
+            if admitted is not None and not admitted.done():
+                admitted.set_result(None)
+            started = time.monotonic()
+            try:
+                response = await self.transport.request(method, url, headers=headers, json=json)
+            except TransportError:
+                self.metrics.record_error(endpoint, request_bytes)
+                self.breaker.record_failure(probe)
+                logger.warn("Error connecting to Daikin Skyport.  Possible connectivity outage.")
+                return None
+            except asyncio.CancelledError:
+                self.breaker.record_cancel(probe)
+                raise
+        finally:
+            self.scheduler.release()
+        self.metrics.record(endpoint, request_bytes, len(response.body), response.status)
+        if method == 'GET':
+            self.read_latency.record(time.monotonic() - started)
+        if response.status >= HTTP_SERVER_ERROR:
+            self.breaker.record_failure(probe)
         else:
-            self.refresh_token = ''
-            self.request_tokens()
-            return
+            self.breaker.record_success()
+        return response
 
-        self.update()
+    async def send_hedged(self, method, url, headers=None, priority=PRIORITY_POLL):
+        ''' send() for idempotent requests, duplicated once if the first
+        attempt has been out for longer than the observed p95 and the cycle's
+        hedge budget allows it.  Time spent queued before the request goes
+        out does not count.  Never hedges while the circuit breaker is open.
+        Raises CircuitOpenError only if every attempt was refused by it. '''
+        delay = self.read_latency.percentile(HEDGE_PERCENTILE)
+        admitted = asyncio.get_running_loop().create_future()
+        first = asyncio.ensure_future(self.send(method, url, headers=headers, priority=priority,
+                                                admitted=admitted))
+        tasks = {first}
+        try:
+            if self.hedging and delay is not None:
+                await asyncio.wait({first, admitted}, return_when=asyncio.FIRST_COMPLETED)
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.hedges_left > 0 and not self.breaker.is_open:
+                    logger.debug("Hedging slow request %s %s", method, url)
+                    self.hedges_left -= 1
+                    self.hedges_sent += 1
+                    tasks.add(asyncio.ensure_future(
+                        self.send(method, url, headers=headers, priority=priority)))
+            pending = tasks
+            response = None
+            refused = failed = False
+            while pending and response is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        result = task.result()
+                    except CircuitOpenError:
+                        refused = True
+                        continue
+                    if result is None:
+                        failed = True
+                    else:
+                        response = result
+            if response is None and refused and not failed:
+                raise CircuitOpenError()
+            return response
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    def request_tokens(self):
-        ''' Method to request API tokens from skyport '''
-        url = 'https://api.daikinskyport.com/users/auth/login'
-        header = {'Accept': 'application/json',
-                  'Content-Type': 'application/json'}
+    async def request_tokens(self):
+        ''' Method to request API tokens from skyport.
+        Concurrent callers share one login, and logins are at least
+        login_cooldown seconds apart. '''
+        return await self.single_flight.run(('login',), self.login)
+
+    async def login(self):
+        url = DAIKIN_API_URL + '/users/auth/login'
+        if self.user_password is None:
+            logger.error("Cannot log in to Daikin Skyport: no password in config.")
+            return False
+        now = time.monotonic()
+        if self.last_login is not None and now - self.last_login < self.login_cooldown:
+            logger.warn("Not logging in to Daikin Skyport again within %s seconds.",
+                        self.login_cooldown)
+            return False
+        self.last_login = now
         data = {"email": self.user_email, "password": self.user_password}
         try:
-            request = requests.post(url, headers=header, json=data)
-        except RequestException:
-            logger.warn("Error connecting to Daikin Skyport.  Possible connectivity outage."
-                        "Could not request token.")
-            return
-        if request.status_code == requests.codes.ok:
-            self.access_token = request.json()['accessToken']
-            self.refresh_token = request.json()['refreshToken']
+            request = await self.send('POST', url, json=data, priority=PRIORITY_INTERACTIVE)
+        except CircuitOpenError:
+            request = None
+        if request is None:
+            logger.warn("Could not request token.")
+            return False
+        status = request.status
+        if status == HTTP_OK:
+            response = request.json()
+            self.access_token = response['accessToken']
+            self.refresh_token = response['refreshToken']
             if self.refresh_token is None:
                 logger.error("Auth did not return a refresh token.")
-            else:
-                self.write_tokens_to_file()
+                return False
+            self.token_received(response.get('accessTokenExpiresIn'))
+            # A new refresh token is saved right away, not debounced: a script
+            # that exits without close() must not have to log in on every run.
+            await self.flush_tokens()
+            return True
         else:
             logger.warn('Error while requesting tokens from daikinskyport.com.'
-                        ' Status code: ' + str(request.status_code))
-            return
+                        ' Status code: ' + str(status))
+            return False
 
-    def refresh_tokens(self):
-        ''' Method to refresh API tokens from daikinskyport.com '''
-        url = 'https://api.daikinskyport.com/users/auth/token'
-        header = {'Accept': 'application/json',
-                  'Content-Type': 'application/json'}
-        data = {'email': self.user_email,
-                  'refreshToken': self.refresh_token}
-        request = requests.post(url, headers=header, json=data)
-        if request.status_code == requests.codes.ok:
-            self.access_token = request.json()['accessToken']
-            self.write_tokens_to_file()
+    async def refresh_tokens(self, used_token=None):
+        ''' Method to refresh API tokens from daikinskyport.com.
+        Concurrent callers share one refresh.  used_token is the access token
+        a rejected request was sent with; if it has been replaced since, the
+        new token is reused instead of refreshing again. '''
+        if used_token is not None and used_token != self.access_token:
             return True
+        return await self.single_flight.run(('token',), self.fetch_tokens)
+
+    async def reauthorize(self, endpoint, attempt, used_token):
+        ''' A request to endpoint sent with used_token was rejected.  Get a
+        fresh token and return True if the request may be retried with it.
+        Only the caller that starts a refresh is charged the per-cycle retry
+        budget; callers reusing a token that was already refreshed, or
+        joining the refresh in flight, are not. '''
+        shared = used_token != self.access_token or ('token',) in self.single_flight.calls
+        if not self.retry_policy.allow(endpoint, attempt, shared):
+            return False
+        return await self.refresh_tokens(used_token)
+
+    async def fetch_tokens(self):
+        # A refresh token the API has rejected is not offered again; go
+        # straight to the login fallback instead.
+        if self.refresh_token != self.rejected_refresh_token:
+            url = DAIKIN_API_URL + '/users/auth/token'
+            data = {'email': self.user_email,
+                      'refreshToken': self.refresh_token}
+            try:
+                request = await self.send('POST', url, json=data, priority=PRIORITY_INTERACTIVE)
+            except CircuitOpenError:
+                request = None
+            if request is None:
+                logger.warn("Could not refresh token.")
+                return False
+            if request.status == HTTP_OK:
+                response = request.json()
+                self.access_token = response['accessToken']
+                self.token_received(response.get('accessTokenExpiresIn'))
+                self.write_tokens_to_file()
+                return True
+            if request.status < HTTP_SERVER_ERROR:
+                self.rejected_refresh_token = self.refresh_token
+        if self.retry_policy.allow(ENDPOINT_LOGIN, 0):
+            # The refresh token was rejected; fall back to a full login, which
+            # counts against the same retry budget.
+            return await self.request_tokens()
         else:
-            self.request_tokens()
+            return False
 
-    def get_thermostats(self):
-        ''' Set self.thermostats to a json list of thermostats from daikinskyport.com '''
-        url = 'https://api.daikinskyport.com/devices'
-        header = {'Content-Type': 'application/json;charset=UTF-8',
-                  'Authorization': 'Bearer ' + self.access_token}
-        try:
-            request = requests.get(url, headers=header)
-        except RequestException:
-            logger.warn("Error connecting to Daikin Skyport.  Possible connectivity outage.")
+    def token_received(self, expires_in):
+        ''' Note the lifetime of a new access token and make sure it is
+        refreshed in the background before it runs out.  Without
+        expires_in, the lifetime is read from the token itself if it is a JWT. '''
+        if expires_in is None:
+            expiry = token_expiry(self.access_token)
+            if expiry is not None:
+                expires_in = expiry - time.time() - JWT_CLOCK_SKEW
+        if expires_in is None:
+            self.token_expires = None
+            return
+        self.token_expires = time.monotonic() + expires_in
+        if self.token_refresher is None or self.token_refresher.done():
+            self.token_refresher = asyncio.ensure_future(self.refresh_ahead())
+
+    async def refresh_ahead(self):
+        ''' Refresh the access token token_refresh_margin seconds before it
+        expires, so requests never have to be retried after a 401 '''
+        while self.token_expires is not None:
+            now = time.monotonic()
+            refresh_at = self.token_expires - self.token_refresh_margin
+            if now < refresh_at:
+                # token_expires may move while we sleep; check again after.
+                await asyncio.sleep(refresh_at - now)
+                continue
+            if now >= self.token_expires:
+                # Too late; the next request falls back to the 401 path.
+                return
+            expires = self.token_expires
+            logger.debug("Refreshing the Daikin Skyport access token before it expires.")
+            if not await self.refresh_tokens() and self.token_expires == expires:
+                await asyncio.sleep(min(TOKEN_RETRY_INTERVAL,
+                                        max(expires - time.monotonic(), 0)))
+
+    def flight_key(self, priority, *key):
+        ''' Single-flight key: callers only share a request started after the
+        last write, and confirmations never wait on a background poll '''
+        return key + (self.write_generation, priority <= PRIORITY_CONFIRM)
+
+    async def get_thermostats(self, priority=PRIORITY_POLL):
+        ''' Set self.thermostats to a json list of thermostats from daikinskyport.com.
+        Concurrent callers share a single in-flight refresh. '''
+        return await self.single_flight.run(self.flight_key(priority, 'account'),
+                                            lambda: self.fetch_thermostats(priority))
+
+    async def fetch_thermostats(self, priority=PRIORITY_POLL):
+        loop = asyncio.get_running_loop()
+        generation = self.write_generation
+        self.hedges_left = self.max_hedges
+        self.retry_policy.new_cycle()
+        deadline = None
+        if self.cycle_deadline is not None:
+            deadline = loop.time() + self.cycle_deadline
+        self.fresh_devices = set()
+        if self.device_list_expired() and not await self.fetch_device_list(priority):
+            # Entities keep being served from the last good snapshot.
+            self.stale_devices.update(thermostat['id'] for thermostat in self.thermostats)
             return None
-        if request.status_code == requests.codes.ok:
-            self.authenticated = True
-            self.thermostatlist = request.json()
-            for thermostat in self.thermostatlist:
-                overwrite = False
-                thermostat_info = self.get_thermostat_info(thermostat['id'])
-                thermostat_info['name'] = thermostat['name']
-                thermostat_info['id'] = thermostat['id']
-                for index in range(len(self.thermostats)):
-                    if thermostat['id'] == self.thermostats[index]['id']:
-                        overwrite = True
-                        self.thermostats[index] = thermostat_info
-                if not overwrite:
-                    self.thermostats.append(thermostat_info)
-            return self.thermostats
-        else:
+        # Background polls skip devices that are backing off; commands and
+        # their confirmations always try.
+        tasks = [asyncio.ensure_future(self.get_thermostat_info(thermostat['id'], priority))
+                 if priority <= PRIORITY_CONFIRM or self.device_backoff.ready(thermostat['id'])
+                 else None
+                 for thermostat in self.thermostatlist]
+        running = [task for task in tasks if task is not None]
+        done = set()
+        if running:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - loop.time(), 0)
+            done, pending = await asyncio.wait(running, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        # Merge in thermostatlist order, so the result is deterministic no
+        # matter which device answered first.
+        for thermostat, task in zip(self.thermostatlist, tasks):
+            deviceid = thermostat['id']
+            if task is None:
+                self.stale_devices.add(deviceid)
+                continue
+            thermostat_info = None
+            failed = deviceid in self.device_errors
+            if task in done:
+                if task.exception() is None:
+                    thermostat_info = task.result()
+                else:
+                    logger.warn("Error fetching Daikin Skyport data for %s: %s",
+                                deviceid, task.exception())
+                    failed = True
+            if thermostat_info is None:
+                logger.debug("No fresh data for %s in this cycle; keeping the last snapshot.",
+                             deviceid)
+                self.stale_devices.add(deviceid)
+                # Only a device that got an error response or a transport
+                # failure backs off; a breaker refusal or the cycle deadline
+                # says nothing about the device itself.
+                if failed:
+                    self.device_backoff.record_failure(deviceid)
+                continue
+            self.store_thermostat(thermostat, thermostat_info, generation)
+        return self.thermostats
+
+    def store_thermostat(self, thermostat, thermostat_info, generation=None):
+        ''' Put a fresh snapshot in self.thermostats and return its index.
+        Existing devices keep their index; new ones are appended.  A snapshot
+        fetched before a later write (generation) that has already been
+        stored is dropped, and None is returned. '''
+        if generation is None:
+            generation = self.write_generation
+        if generation < self.snapshot_generation.get(thermostat['id'], 0):
+            logger.debug("Dropping %s snapshot fetched before the last write.", thermostat['id'])
+            return None
+        self.snapshot_generation[thermostat['id']] = generation
+        self.stale_devices.discard(thermostat['id'])
+        self.device_errors.discard(thermostat['id'])
+        self.fresh_devices.add(thermostat['id'])
+        self.device_backoff.record_success(thermostat['id'])
+        self.last_updated[thermostat['id']] = time.monotonic()
+        thermostat_info['name'] = thermostat['name']
+        thermostat_info['id'] = thermostat['id']
+        for index in range(len(self.thermostats)):
+            if thermostat['id'] == self.thermostats[index]['id']:
+                self.thermostats[index] = thermostat_info
+                return index
+        self.thermostats.append(thermostat_info)
+        index = len(self.thermostats) - 1
+        if self.new_device_callback is not None:
+            self.new_device_callback(index)
+        return index
+
+    def device_list_expired(self):
+        ''' True if the cached /devices list must be fetched again '''
+        return (self.devices_fetched is None or
+                time.monotonic() - self.devices_fetched >= self.devices_ttl)
+
+    def invalidate_device_list(self):
+        ''' Force the next cycle to fetch /devices again '''
+        self.devices_fetched = None
+
+    async def fetch_device_list(self, priority=PRIORITY_POLL):
+        ''' Set self.thermostatlist from /devices.  Returns True on success '''
+        url = DAIKIN_API_URL + '/devices'
+        attempt = 0
+        while True:
+            token = self.access_token
+            try:
+                request = await self.send('GET', url, headers=self.auth_header(),
+                                          priority=priority)
+            except CircuitOpenError:
+                return False
+            if request is None:
+                return False
+            if request.status == HTTP_OK:
+                self.authenticated = True
+                self.thermostatlist = request.json()
+                self.devices_fetched = time.monotonic()
+                self.prune_devices()
+                return True
             self.authenticated = False
             logger.debug("Error connecting to Daikin Skyport while attempting to get "
                         "thermostat data.  Refreshing tokens and trying again.")
-            if self.refresh_tokens():
-                return self.get_thermostats()
-            else:
-                return None
+            if not await self.reauthorize(ENDPOINT_DEVICES, attempt, token):
+                return False
+            attempt += 1
 
-    def get_thermostat_info(self, deviceid):
-        ''' Retrieve the device info for the specific device '''
-        url = 'https://api.daikinskyport.com/deviceData/' + deviceid
-        header = {'Content-Type': 'application/json;charset=UTF-8',
-                  'Authorization': 'Bearer ' + self.access_token}
-        try:
-            request = requests.get(url, headers=header)
-        except RequestException:
-            logger.warn("Error connecting to Daikin Skyport.  Possible connectivity outage.")
-            return None
-        if request.status_code == requests.codes.ok:
-            self.authenticated = True
-            return request.json()
-        else:
+    def prune_devices(self):
+        ''' Drop the snapshots and per-device state of devices that are no
+        longer on the account.  Later thermostats move up one index. '''
+        current = {thermostat['id'] for thermostat in self.thermostatlist}
+        gone = set(self.last_updated).union(
+            thermostat['id'] for thermostat in self.thermostats) - current
+        if not gone:
+            return
+        logger.debug("Devices %s left the account; dropping their data.", sorted(gone))
+        self.thermostats[:] = [thermostat for thermostat in self.thermostats
+                               if thermostat['id'] in current]
+        for deviceid in gone:
+            for state in (self.last_updated, self.snapshot_generation,
+                          self.validators, self.body_hashes):
+                state.pop(deviceid, None)
+            for state in (self.stale_devices, self.fresh_devices, self.device_errors):
+                state.discard(deviceid)
+            self.device_backoff.record_success(deviceid)
+
+    async def fetch_limited_thermostat_info(self, deviceid, priority=PRIORITY_POLL):
+        ''' fetch_thermostat_info bounded by the per-account concurrency limit.
+        Confirmations skip it; the scheduler keeps a slot free for them. '''
+        if priority <= PRIORITY_CONFIRM:
+            return await self.fetch_thermostat_info(deviceid, priority)
+        async with self.device_semaphore:
+            return await self.fetch_thermostat_info(deviceid, priority)
+
+    def cached_thermostat(self, deviceid):
+        ''' Return the last snapshot stored for deviceid, or None '''
+        for thermostat in self.thermostats:
+            if thermostat['id'] == deviceid:
+                return thermostat
+        return None
+
+    async def get_thermostat_info(self, deviceid, priority=PRIORITY_POLL):
+        ''' Retrieve the device info for the specific device.
+        Concurrent callers for the same device share a single request. '''
+        if not any(thermostat['id'] == deviceid for thermostat in self.thermostatlist):
+            self.invalidate_device_list()
+        return await self.single_flight.run(
+            self.flight_key(priority, 'device', deviceid),
+            lambda: self.fetch_limited_thermostat_info(deviceid, priority))
+
+    async def fetch_thermostat_info(self, deviceid, priority=PRIORITY_POLL):
+        url = DAIKIN_API_URL + '/deviceData/' + deviceid
+        self.device_errors.discard(deviceid)
+        attempt = 0
+        while True:
+            token = self.access_token
+            header = self.auth_header()
+            cached = self.cached_thermostat(deviceid)
+            if cached is not None:
+                validators = self.validators.get(deviceid, {})
+                if 'ETag' in validators:
+                    header['If-None-Match'] = validators['ETag']
+                if 'Last-Modified' in validators:
+                    header['If-Modified-Since'] = validators['Last-Modified']
+            try:
+                request = await self.send_hedged('GET', url, headers=header, priority=priority)
+            except CircuitOpenError:
+                # Not this device's fault; it is not charged a backoff.
+                return None
+            if request is None:
+                self.device_errors.add(deviceid)
+                return None
+            if request.status == HTTP_NOT_MODIFIED and cached is not None:
+                self.authenticated = True
+                return cached
+            if request.status == HTTP_OK:
+                self.authenticated = True
+                self.validators[deviceid] = {key: request.headers[key]
+                                             for key in ('ETag', 'Last-Modified')
+                                             if key in request.headers}
+                # Servers that ignore the validators still send identical bodies
+                # when nothing changed; skip the json decode in that case.
+                digest = hashlib.blake2b(request.body, digest_size=16).digest()
+                if cached is not None and self.body_hashes.get(deviceid) == digest:
+                    return cached
+                self.body_hashes[deviceid] = digest
+                if self.projection is not None:
+                    return self.projection.extract(request.body)
+                return request.json()
+            if request.status == HTTP_NOT_FOUND:
+                logger.debug("Device %s not found; refreshing the device list.", deviceid)
+                self.invalidate_device_list()
+                self.device_errors.add(deviceid)
+                return None
+            if request.status != HTTP_UNAUTHORIZED:
+                self.device_errors.add(deviceid)
             self.authenticated = False
             logger.debug("Error connecting to Daikin Skyport while attempting to get "
                         "thermostat data.  Refreshing tokens and trying again.")
-            if self.refresh_tokens():
-                return self.get_thermostat_info(deviceid)
-            else:
+            if not await self.reauthorize(ENDPOINT_DEVICE_DATA, attempt, token):
                 return None
+            attempt += 1
+
+    async def refresh_thermostat(self, index, priority=PRIORITY_CONFIRM):
+        ''' Re-read one thermostat, ie to confirm a command sent to it, and
+        store its snapshot.  Returns True if the snapshot was refreshed. '''
+        thermostat = {key: self.thermostats[index][key] for key in ('id', 'name')}
+        generation = self.write_generation
+        thermostat_info = await self.get_thermostat_info(thermostat['id'], priority)
+        if thermostat_info is None:
+            self.stale_devices.add(thermostat['id'])
+            return False
+        self.store_thermostat(thermostat, thermostat_info, generation)
+        return True
 
     def get_thermostat(self, index):
         ''' Return a single thermostat based on index '''
         return self.thermostats[index]
 
+    def is_stale(self, deviceid):
+        ''' True if the last cycle could not refresh this device's snapshot '''
+        return deviceid in self.stale_devices
+
+    def device_status(self):
+        ''' Per device: whether the last cycle refreshed it, its consecutive
+        failures and the seconds until a background poll tries it again '''
+        return {thermostat['id']: {'fresh': thermostat['id'] in self.fresh_devices,
+                                   'failures': self.device_backoff.failures[thermostat['id']],
+                                   'retry_in': self.device_backoff.retry_in(thermostat['id'])}
+                for thermostat in self.thermostatlist}
+
+    def rate_limit_wait(self):
+        ''' Total seconds callers have spent queued on the rate limiters '''
+        return {'read': self.read_limiter.total_wait,
+                'write': self.write_limiter.total_wait}
+
+    def network_stats(self):
+        ''' Requests, payload bytes, status codes, errors and retries per endpoint '''
+        stats = self.metrics.snapshot(ENDPOINTS)
+        for endpoint, counters in stats.items():
+            counters['retries'] = self.retry_policy.retries[endpoint]
+        return stats
+
     def get_sensors(self, index):
         ''' Return sensors based on index '''
         sensors = list()
@@ -211,51 +824,181 @@ class DaikinSkyport(object):
         return sensors
 
     def write_tokens_to_file(self):
-        ''' Write api tokens to a file '''
+        ''' Save api tokens to the token store.  Unchanged tokens are not
+        saved again; changes are saved TOKEN_SAVE_DELAY seconds after the
+        last one. '''
+        if (self.access_token, self.refresh_token) == self.saved_tokens:
+            return
+        if self.token_save is not None:
+            self.token_save.cancel()
+        self.token_save = asyncio.get_running_loop().call_later(TOKEN_SAVE_DELAY,
+                                                                self.start_token_save)
+
+    def token_config(self):
         config = dict()
         config['ACCESS_TOKEN'] = self.access_token
         config['REFRESH_TOKEN'] = self.refresh_token
         config['EMAIL'] = self.user_email
-        if self.file_based_config:
-            config_from_file(self.config_filename, config)
+        return config
+
+    def start_token_save(self):
+        self.token_save = None
+        self.token_saving = asyncio.ensure_future(self.save_tokens())
+
+    async def flush_tokens(self):
+        ''' Save the tokens now rather than after the debounce delay '''
+        if self.token_save is not None:
+            self.token_save.cancel()
+            self.token_save = None
+        await self.save_tokens()
+
+    async def save_tokens(self):
+        ''' Save the current tokens to the token store if they changed '''
+        # Serialized so an older save can never land after a newer one.
+        async with self.token_save_lock:
+            tokens = (self.access_token, self.refresh_token)
+            if tokens == self.saved_tokens:
+                return
+            if await self.token_store.save(self.token_config()):
+                self.saved_tokens = tokens
+
+    async def update(self, priority=PRIORITY_POLL, max_staleness=None):
+        ''' Get new thermostat data from daikin skyport.
+        With max_staleness (seconds), return right away while the snapshot is
+        at most that old and revalidate it in the background; only wait for
+        the network once the snapshot is older or missing. '''
+        age = self.data_age()
+        if max_staleness is None or age is None or age > max_staleness:
+            await self.get_thermostats(priority)
+        elif self.revalidation is None or self.revalidation.done():
+            self.revalidation = asyncio.ensure_future(self.get_thermostats(priority))
+            self.revalidation.add_done_callback(self.revalidated)
+
+    def revalidated(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warn("Background refresh of Daikin Skyport data failed: %s", task.exception())
+
+    def register_projection(self, keys=(), prefixes=()):
+        ''' Keep only these keys (and keys starting with these prefixes) from
+        /deviceData.  The first call switches the client to projected snapshots. '''
+        if self.projection is None:
+            self.projection = KeyProjection()
+        self.projection.register(keys, prefixes)
+        # Snapshots kept from a full parse must not be reused as projected ones.
+        self.body_hashes.clear()
+
+    def data_age(self, deviceid=None):
+        ''' Seconds since the snapshot of deviceid was fetched, or None if
+        there is none.  Without deviceid, the oldest snapshot of the devices
+        that are polled: devices backing off are left out, so one dead
+        thermostat does not make every update wait for the network. '''
+        if deviceid is not None:
+            updated = self.last_updated.get(deviceid)
         else:
-            self.config = config
+            updated = min((self.last_updated[thermostat['id']]
+                           for thermostat in self.thermostatlist
+                           if thermostat['id'] in self.last_updated and
+                           self.device_backoff.ready(thermostat['id'])), default=None)
+        if updated is None:
+            return None
+        return time.monotonic() - updated
 
-    def update(self):
-        ''' Get new thermostat data from daikin skyport '''
-        self.get_thermostats()
+    def auth_header(self):
+        ''' Per-request Authorization header; the rest come from the transport '''
+        return {'Authorization': 'Bearer ' + self.access_token}
 
-    def make_request(self, index, body, log_msg_action, *, retry_count=0):
+    async def close(self):
+        ''' Cancel background refreshes and close the pooled connections to daikinskyport.com '''
+        tasks = list(self.single_flight.calls.values())
+        for task in (self.revalidation, self.token_refresher, self.bootstrapping):
+            if task is not None:
+                tasks.append(task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Write out tokens still waiting for their debounced save.
+        await self.flush_tokens()
+        await self.transport.close()
+
+    async def make_request(self, index, body, log_msg_action, retries=0,
+                           priority=PRIORITY_INTERACTIVE, prepaid=False):
+        ''' PUT body to a thermostat.  Connection errors and 5xx responses are
+        retried up to retries times, with a short backoff, while the circuit
+        breaker stays closed.  prepaid says the write token for the first
+        attempt is already taken. '''
         deviceID = self.thermostats[index]['id']
-        url = 'https://api.daikinskyport.com/deviceData/' + deviceID
-        header = {'Content-Type': 'application/json;charset=UTF-8',
-                  'Authorization': 'Bearer ' + self.access_token}
+        url = DAIKIN_API_URL + '/deviceData/' + deviceID
         logger.debug("Make Request: Device: %s, Body: %s", deviceID, body)
-        try:
-            request = requests.put(url, headers=header, json=body)
-        except RequestException:
-            logger.warn("Error connecting to Daikin Skyport.  Possible connectivity outage.")
-            return None
-        if request.status_code == requests.codes.ok:
-            return request
-        elif (request.status_code == 401 and retry_count == 0 and
-              request.json()['error'] == 'authorization_expired'):
-            if self.refresh_tokens():
-                return self.make_request(body, deviceID, log_msg_action,
-                                         retry_count=retry_count + 1)
-        else:
-            logger.warn(
-                "Error fetching data from Daikin Skyport while attempting to %s: %s",
-                log_msg_action, request.json())
-            return None
+        attempt = 0
+        delay = WRITE_RETRY_DELAY
+        while True:
+            token = self.access_token
+            try:
+                request = await self.send('PUT', url, headers=self.auth_header(), json=body,
+                                          priority=priority, prepaid=prepaid)
+            except CircuitOpenError:
+                return None
+            prepaid = False
+            if request is None or request.status >= HTTP_SERVER_ERROR:
+                if retries > 0 and not self.breaker.is_open:
+                    logger.debug("Retrying %s on %s", log_msg_action, deviceID)
+                    retries -= 1
+                    self.retry_policy.record(ENDPOINT_DEVICE_WRITE)
+                    await asyncio.sleep(random.uniform(delay / 2, delay))
+                    delay *= 2
+                    continue
+                if request is None:
+                    return None
+            if request.status == HTTP_OK:
+                self.write_generation += 1
+                return request
+            elif (request.status == HTTP_UNAUTHORIZED and
+                  request.json()['error'] == 'authorization_expired'):
+                if not await self.reauthorize(ENDPOINT_DEVICE_WRITE, attempt, token):
+                    return None
+                attempt += 1
+            else:
+                logger.warn(
+                    "Error fetching data from Daikin Skyport while attempting to %s: %s",
+                    log_msg_action, request.json())
+                return None
+
+    async def bulk_update(self, targets, log_msg_action="update thermostats",
+                          max_parallel=DEFAULT_BULK_PARALLELISM, retries=DEFAULT_WRITE_RETRIES):
+        ''' PUT to several thermostats concurrently.  targets maps a thermostat
+        index to the body for that thermostat.  At most max_parallel PUTs are
+        in flight, each retried as in make_request.  As many PUTs as the write
+        budget has tokens for go out right away; the rest wait for tokens
+        behind interactive commands, so a bulk update never holds up a
+        setpoint change.  Returns {index: response or None}. '''
+        semaphore = asyncio.Semaphore(max_parallel)
+
+        async def put(index, body, prepaid):
+            async with semaphore:
+                return await self.make_request(index, body, log_msg_action, retries,
+                                               PRIORITY_CONFIRM, prepaid)
 
-    def set_hvac_mode(self, index, hvac_mode):
+        indexes = list(targets)
+        prepaid = self.write_limiter.take(len(indexes))
+        results = await asyncio.gather(*(put(index, targets[index], position < prepaid)
+                                         for position, index in enumerate(indexes)),
+                                       return_exceptions=True)
+        outcome = dict()
+        for index, result in zip(indexes, results):
+            if isinstance(result, Exception):
+                logger.warn("Error while attempting to %s on thermostat %s: %s",
+                            log_msg_action, index, result)
+                result = None
+            outcome[index] = result
+        return outcome
+
+    async def set_hvac_mode(self, index, hvac_mode):
         ''' possible modes are DAIKIN_HVAC_MODE_{OFF,HEAT,COOL,AUTO,AUXHEAT} '''
         body = {"mode": hvac_mode}
         log_msg_action = "set HVAC mode"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_thermostat_schedule(self, index, prefix, start, enable, label, heating, cooling):
+    async def set_thermostat_schedule(self, index, prefix, start, enable, label, heating, cooling):
         ''' Schedule to set the thermostat.
         prefix is the beginning of the JSON key to modify.  It consists of "sched" + [Mon,Tue,Wed,Thu,Fri,Sat,Sun] + "Part" + [1:6] (ex. schedMonPart1)
         start is the beginning of the schedule.  It is an integer value where every 15 minutes from 00:00 is 1 (each hour = 4)
@@ -271,28 +1014,28 @@ class DaikinSkyport(object):
                 }
 
         log_msg_action = "set thermostat schedule"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_fan_mode(self, index, fan_mode):
+    async def set_fan_mode(self, index, fan_mode):
         ''' Set fan mode. Values: auto (0), schedule (2), on (1) '''
         body = {"fanCirculate": fan_mode}
         log_msg_action = "set fan mode"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_fan_speed(self, index, fan_speed):
+    async def set_fan_speed(self, index, fan_speed):
         ''' Set fan speed. Values: low (0), medium (1), high (2) '''
         body = {"fanCirculateSpeed": fan_speed}
         log_msg_action = "set fan speed"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_fan_clean(self, index, active):
+    async def set_fan_clean(self, index, active):
         ''' Enable/disable fan clean mode.  This runs the fan at high speed to clear out the air.
         active values are true/false'''
         body = {"oneCleanFanActive": active}
         log_msg_action = "set fan clean mode"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_temp_hold(self, index, cool_temp=None, heat_temp=None,
+    async def set_temp_hold(self, index, cool_temp=None, heat_temp=None,
                       hold_duration=None):
         ''' Set a temporary hold '''
         if hold_duration is None:
@@ -307,9 +1050,9 @@ class DaikinSkyport(object):
                 "schedOverrideDuration": hold_duration
                 }
         log_msg_action = "set hold temp"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_permanent_hold(self, index, cool_temp=None, heat_temp=None):
+    async def set_permanent_hold(self, index, cool_temp=None, heat_temp=None):
         ''' Set a climate hold - ie enable/disable schedule. 
         active values are true/false
         hold_duration is NEXT_SCHEDULE'''
@@ -323,9 +1066,9 @@ class DaikinSkyport(object):
                 "schedEnabled": False
                 }
         log_msg_action = "set permanent hold"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_away(self, index, mode, heat_temp=None, cool_temp=None):
+    async def set_away(self, index, mode, heat_temp=None, cool_temp=None):
         ''' Enable/Disable the away setting and optionally set the away temps '''
         if heat_temp is None:
             heat_temp = round(self.thermostats[index]["hspAway"], 1)
@@ -337,19 +1080,14 @@ class DaikinSkyport(object):
                 }
 
         log_msg_action = "set away mode"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def resume_program(self, index):
+    async def resume_program(self, index):
         ''' Resume currently scheduled program '''
-        body = {"schedEnabled": True,
-                "schedOverride": 0,
-                "geofencingAway": False
-                }
-
         log_msg_action = "resume program"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, RESUME_PROGRAM_BODY, log_msg_action)
 
-    def set_fan_schedule(self, index, start, stop, interval, speed):
+    async def set_fan_schedule(self, index, start, stop, interval, speed):
         ''' Schedule to run the fan.  
         start_time is the beginning of the schedule per day.  It is an integer value where every 15 minutes from 00:00 is 1 (each hour = 4)
         end_time is the end of the schedule each day.  Values are same as start_time
@@ -362,9 +1100,9 @@ class DaikinSkyport(object):
                 }
 
         log_msg_action = "set fan schedule"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_night_mode(self, index, start, stop, enable):
+    async def set_night_mode(self, index, start, stop, enable):
         ''' Set the night mode parameters '''
         body = {"nightModeStart": start,
                 "nightModeStop": stop,
@@ -372,9 +1110,9 @@ class DaikinSkyport(object):
                 }
 
         log_msg_action = "set night mode"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
 
-    def set_humidity(self, index, humidity_low=None, humidity_high=None):
+    async def set_humidity(self, index, humidity_low=None, humidity_high=None):
         ''' Set humidity level'''
         if humidity_low is None:
             humidity_low = self.thermostats[index]["humSP"]
@@ -385,4 +1123,118 @@ class DaikinSkyport(object):
                 }
 
         log_msg_action = "set humidity level"
-        return self.make_request(index, body, log_msg_action)
+        return await self.make_request(index, body, log_msg_action)
+
+
+def _sync(name):
+    ''' Build a blocking DaikinSkyport method that runs the AsyncDaikinSkyport coroutine '''
+    def method(self, *args, **kwargs):
+        return self.run(getattr(self.client, name)(*args, **kwargs))
+    method.__name__ = name
+    method.__doc__ = getattr(AsyncDaikinSkyport, name).__doc__
+    return method
+
+
+class DaikinSkyport(object):
+    ''' Blocking wrapper around AsyncDaikinSkyport.
+
+    The async client runs on a private event loop thread so callers in Home
+    Assistant's executor (or plain scripts) can keep using the synchronous API.'''
+
+    def __init__(self, config_filename=None, user_email=None, user_password=None, config=None,
+                 bootstrap=True, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name='daikinskyport', daemon=True)
+        self.thread.start()
+        self.client = AsyncDaikinSkyport(config_filename, user_email, user_password, config,
+                                         **kwargs)
+        if getattr(self.client, 'user_email', None) is None:
+            return
+        if bootstrap:
+            self.run(self.client.bootstrap())
+
+    def start_bootstrap(self, on_device=None):
+        ''' Run AsyncDaikinSkyport.bootstrap in the background, retrying until
+        it succeeds.  on_device(index) is called from the client thread as
+        each device's data arrives.  Returns a concurrent.futures.Future. '''
+        return asyncio.run_coroutine_threadsafe(self.client.bootstrap_until_ready(on_device),
+                                                self.loop)
+
+    def run(self, coro):
+        ''' Run a coroutine on the client loop and wait for its result '''
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    @property
+    def thermostats(self):
+        return self.client.thermostats
+
+    @property
+    def thermostatlist(self):
+        return self.client.thermostatlist
+
+    @property
+    def authenticated(self):
+        return self.client.authenticated
+
+    def get_thermostat(self, index):
+        ''' Return a single thermostat based on index '''
+        return self.client.get_thermostat(index)
+
+    def get_sensors(self, index):
+        ''' Return sensors based on index '''
+        return self.client.get_sensors(index)
+
+    def is_stale(self, deviceid):
+        ''' True if the last cycle could not refresh this device's snapshot '''
+        return self.client.is_stale(deviceid)
+
+    def device_status(self):
+        ''' Per device: last cycle freshness, consecutive failures and backoff '''
+        return self.client.device_status()
+
+    def rate_limit_wait(self):
+        ''' Total seconds callers have spent queued on the rate limiters '''
+        return self.client.rate_limit_wait()
+
+    def network_stats(self):
+        ''' Requests, payload bytes, status codes, errors and retries per endpoint '''
+        return self.client.network_stats()
+
+    def data_age(self, deviceid=None):
+        ''' Seconds since the snapshot of deviceid (or the oldest polled one) was fetched '''
+        return self.client.data_age(deviceid)
+
+    def register_projection(self, keys=(), prefixes=()):
+        ''' Keep only these keys (and keys starting with these prefixes) from /deviceData '''
+        self.client.register_projection(keys, prefixes)
+
+    def close(self):
+        ''' Close the pooled connections and stop the client loop '''
+        if self.loop.is_closed():
+            return
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    request_tokens = _sync('request_tokens')
+    refresh_tokens = _sync('refresh_tokens')
+    get_thermostats = _sync('get_thermostats')
+    get_thermostat_info = _sync('get_thermostat_info')
+    refresh_thermostat = _sync('refresh_thermostat')
+    update = _sync('update')
+    make_request = _sync('make_request')
+    bulk_update = _sync('bulk_update')
+    set_hvac_mode = _sync('set_hvac_mode')
+    set_thermostat_schedule = _sync('set_thermostat_schedule')
+    set_fan_mode = _sync('set_fan_mode')
+    set_fan_speed = _sync('set_fan_speed')
+    set_fan_clean = _sync('set_fan_clean')
+    set_temp_hold = _sync('set_temp_hold')
+    set_permanent_hold = _sync('set_permanent_hold')
+    set_away = _sync('set_away')
+    resume_program = _sync('resume_program')
+    set_fan_schedule = _sync('set_fan_schedule')
+    set_night_mode = _sync('set_night_mode')
+    set_humidity = _sync('set_humidity')
@@ -0,0 +1,54 @@
+''' Network I/O accounting for the Daikin Skyport clients '''
+import collections
+
+
+class EndpointCounters(object):
+    ''' Counters for one API endpoint '''
+
+    def __init__(self):
+        self.requests = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.errors = 0
+        self.status_codes = collections.Counter()
+
+    def as_dict(self):
+        return {'requests': self.requests,
+                'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes,
+                'errors': self.errors,
+                'status_codes': dict(self.status_codes)}
+
+
+class NetworkMetrics(object):
+    ''' Per-endpoint request, byte and status code counters.
+
+    Byte counts are payload sizes (JSON request bodies and response bodies as
+    delivered by the transport); HTTP headers and TLS framing are not
+    included.  Requests refused by the circuit breaker never reach the
+    network and are not counted.'''
+
+    def __init__(self):
+        self.endpoints = collections.defaultdict(EndpointCounters)
+
+    def record(self, endpoint, request_bytes, response_bytes, status):
+        counters = self.endpoints[endpoint]
+        counters.requests += 1
+        counters.request_bytes += request_bytes
+        counters.response_bytes += response_bytes
+        counters.status_codes[status] += 1
+
+    def record_error(self, endpoint, request_bytes):
+        ''' A request was sent but no response came back '''
+        counters = self.endpoints[endpoint]
+        counters.requests += 1
+        counters.request_bytes += request_bytes
+        counters.errors += 1
+
+    def snapshot(self, endpoints=()):
+        ''' Return the counters as {endpoint: {counter: value}}, including
+        zeroed entries for any of endpoints not used yet '''
+        stats = {endpoint: EndpointCounters().as_dict() for endpoint in endpoints}
+        stats.update((endpoint, counters.as_dict())
+                     for endpoint, counters in self.endpoints.items())
+        return stats
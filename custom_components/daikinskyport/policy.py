@@ -0,0 +1,337 @@
+''' Request policies shared by the Daikin Skyport clients '''
+import asyncio
+import collections
+import heapq
+import itertools
+import random
+import time
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+# Request priority classes, most urgent first.
+PRIORITY_INTERACTIVE = 0  # user commands (setpoint, mode, ...)
+PRIORITY_CONFIRM = 1      # read-after-write refresh confirming a command
+PRIORITY_POLL = 2         # regular background polling
+PRIORITY_BACKFILL = 3     # bulk/history work that can wait
+
+
+class CircuitOpenError(Exception):
+    ''' A request was refused because the circuit breaker is open '''
+
+
+class CircuitBreaker(object):
+    ''' Circuit breaker for the Skyport cloud.
+
+    After failure_threshold consecutive failures the breaker opens and every
+    request is refused until a jittered, exponentially growing backoff expires.
+    The breaker then goes half-open and lets exactly one probe request through;
+    success closes it, failure opens it again with a longer backoff.
+
+    Not thread safe; it is only used from the client's event loop.'''
+
+    def __init__(self, failure_threshold=3, base_backoff=5, max_backoff=300):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0
+        self.probing = False
+
+    def allow(self):
+        ''' Return True if a request may be sent now.  While half-open the
+        one request allowed is the probe; self.probing is then True. '''
+        if self.state == BREAKER_CLOSED:
+            return True
+        if self.state == BREAKER_OPEN:
+            if time.monotonic() < self.open_until:
+                return False
+            self.state = BREAKER_HALF_OPEN
+            self.probing = False
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        ''' The request reached the API; close the breaker '''
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.probing = False
+
+    def record_failure(self, probe=False):
+        ''' The request failed with a connection error, timeout or 5xx.
+        probe says whether it was the half-open probe. '''
+        if self.state == BREAKER_OPEN or (self.state == BREAKER_HALF_OPEN and not probe):
+            # Requests sent before the breaker opened are still coming back;
+            # they say nothing new and must not lengthen the backoff.
+            return
+        self.failures += 1
+        self.probing = False
+        if self.state == BREAKER_HALF_OPEN or self.failures >= self.failure_threshold:
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** self.trips)
+            # Jitter within [backoff/2, backoff] so installs that lost the
+            # cloud together don't all probe it at the same instant.
+            self.open_until = time.monotonic() + random.uniform(backoff / 2, backoff)
+            self.trips += 1
+            self.state = BREAKER_OPEN
+
+    def record_cancel(self, probe=False):
+        ''' The request was cancelled before it finished; if it was the probe,
+        free the probe slot '''
+        if probe:
+            self.probing = False
+
+    @property
+    def is_open(self):
+        return self.state != BREAKER_CLOSED
+
+
+class TokenBucket(object):
+    ''' Token-bucket rate limiter.
+
+    Allows bursts of up to burst requests and refills at rate tokens per
+    second.  Callers that find the bucket empty wait for a token rather than
+    failing; tokens go to the most urgent waiter first (FIFO within a
+    priority class), so a command never queues behind a poll cycle.  The time
+    spent waiting is accumulated in total_wait.  The bucket never goes below
+    zero.'''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.waiters = list()
+        self.counter = itertools.count()
+        self.timer = None
+        self.waits = 0
+        self.total_wait = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority=PRIORITY_POLL):
+        ''' Wait for and take one token '''
+        self.refill()
+        if not self.waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), waiter))
+        self.waits += 1
+        if self.timer is None:
+            self.dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The token may have been handed over just as we were cancelled.
+            if waiter.done() and not waiter.cancelled():
+                self.tokens += 1
+                self.dispatch()
+            raise
+        finally:
+            self.total_wait += time.monotonic() - started
+
+    def take(self, count):
+        ''' Take up to count tokens that are available right now, without
+        waiting or jumping the queue.  Returns how many were taken. '''
+        self.refill()
+        if self.waiters:
+            return 0
+        taken = min(count, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+    def dispatch(self):
+        ''' Hand available tokens to waiters, and set a timer for the next one '''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.refill()
+        while self.waiters:
+            _, _, waiter = self.waiters[0]
+            if waiter.done():
+                heapq.heappop(self.waiters)
+                continue
+            if self.tokens < 1:
+                self.timer = asyncio.get_running_loop().call_later(
+                    (1 - self.tokens) / self.rate, self.dispatch)
+                return
+            heapq.heappop(self.waiters)
+            self.tokens -= 1
+            waiter.set_result(None)
+
+
+class SingleFlight(object):
+    ''' Coalesce concurrent calls for the same key into one in-flight task.
+
+    The first caller for a key starts the work; everyone arriving while it is
+    still running awaits the same task and gets the same result.  Waiters are
+    shielded, so one caller giving up (ie a cycle deadline) does not cancel
+    the work for the others.'''
+
+    def __init__(self):
+        self.calls = dict()
+
+    async def run(self, key, factory):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self.finished(key, done))
+        return await asyncio.shield(task)
+
+    def finished(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception retrieved even if every waiter was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+
+class RequestScheduler(object):
+    ''' Hands out in-flight request slots by priority.
+
+    Waiters are served most urgent first (FIFO within a class).  Background
+    classes (poll, backfill) may only use capacity - reserved slots, so
+    interactive commands and their confirmations always find a free slot
+    instead of queueing behind a poll cycle.'''
+
+    def __init__(self, capacity, reserved=1):
+        self.capacity = capacity
+        self.reserved = reserved
+        self.active = 0
+        self.waiters = list()
+        self.counter = itertools.count()
+
+    def limit(self, priority):
+        if priority <= PRIORITY_CONFIRM:
+            return self.capacity
+        return self.capacity - self.reserved
+
+    async def acquire(self, priority):
+        ''' Wait for a request slot '''
+        if not self.waiters and self.active < self.limit(priority):
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), waiter))
+        self.wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as we were cancelled.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        ''' Give a slot back and wake the most urgent waiter that may use it '''
+        self.active -= 1
+        self.wake()
+
+    def wake(self):
+        while self.waiters:
+            priority, _, waiter = self.waiters[0]
+            if waiter.done():
+                heapq.heappop(self.waiters)
+                continue
+            if self.active >= self.limit(priority):
+                break
+            heapq.heappop(self.waiters)
+            self.active += 1
+            waiter.set_result(None)
+
+
+class LatencyTracker(object):
+    ''' Rolling window of request latencies '''
+
+    def __init__(self, window=200, min_samples=20):
+        self.samples = collections.deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, percent):
+        ''' Return the given percentile in seconds, or None until enough samples exist '''
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class DeviceBackoff(object):
+    ''' Consecutive failure counts and poll backoff per device.
+
+    A device whose snapshot could not be fetched is skipped by background
+    polls for base_backoff * 2 ** (failures - 1) seconds, capped at
+    max_backoff, so one unreachable thermostat does not use up request slots,
+    retries and deadline time every cycle.  A success resets it.'''
+
+    def __init__(self, base_backoff=30, max_backoff=600):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.failures = collections.Counter()
+        self.retry_at = dict()
+
+    def ready(self, deviceid):
+        ''' Return True if deviceid may be polled now '''
+        return time.monotonic() >= self.retry_at.get(deviceid, 0)
+
+    def retry_in(self, deviceid):
+        ''' Seconds until deviceid is polled again (0 if it is not backing off) '''
+        return max(0, self.retry_at.get(deviceid, 0) - time.monotonic())
+
+    def record_success(self, deviceid):
+        self.failures.pop(deviceid, None)
+        self.retry_at.pop(deviceid, None)
+
+    def record_failure(self, deviceid):
+        self.failures[deviceid] += 1
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.failures[deviceid] - 1))
+        self.retry_at[deviceid] = time.monotonic() + backoff
+
+
+class RetryPolicy(object):
+    ''' Retry budget shared by every endpoint of one client.
+
+    A single call may retry at most per_call times, and all calls together
+    at most per_cycle times until new_cycle() is called at the start of the
+    next poll cycle.  This bounds the requests one cycle can generate when
+    authentication keeps failing.  Granted retries are counted per endpoint.'''
+
+    def __init__(self, per_call=1, per_cycle=4):
+        self.per_call = per_call
+        self.per_cycle = per_cycle
+        self.cycle_left = per_cycle
+        self.retries = collections.Counter()
+
+    def new_cycle(self):
+        self.cycle_left = self.per_cycle
+
+    def allow(self, endpoint, attempt, shared=False):
+        ''' Return True, and count it, if a call that has already retried
+        attempt times may retry once more.  A shared retry reuses work
+        another call has already been charged for (ie its token refresh)
+        and does not use up the per-cycle budget. '''
+        if attempt >= self.per_call or (not shared and self.cycle_left <= 0):
+            return False
+        if not shared:
+            self.cycle_left -= 1
+        self.retries[endpoint] += 1
+        return True
+
+    def record(self, endpoint):
+        ''' Count a retry that has a budget of its own, ie a write's retries
+        after connection errors '''
+        self.retries[endpoint] += 1
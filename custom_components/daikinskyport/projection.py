@@ -0,0 +1,52 @@
+''' Key projection for /deviceData snapshots.
+
+A /deviceData document is a flat JSON object with about 900 keys, of which
+the integration reads about a hundred.  KeyProjection keeps only the
+registered keys of each document, so the snapshot held per thermostat
+between polls is a fraction of the full one.
+
+The body is still decoded in full with json.loads.  On CPython no
+incremental parser -- a regex scan over the body, or ijson even with its
+yajl2_c backend -- decodes these documents faster than the C json decoder,
+so projecting after the decode is the cheapest option.  It shrinks the
+resident snapshots, not the peak memory of the decode itself.'''
+import json
+
+# Documents with more key layouts than this (ie many firmware versions on one
+# account) clear the layout cache instead of growing it.
+MAX_LAYOUTS = 8
+
+
+class KeyProjection(object):
+    ''' Keep registered keys (exact names or name prefixes) of a flat JSON object '''
+
+    def __init__(self, keys=(), prefixes=()):
+        self.keys = set()
+        self.prefixes = tuple()
+        self.layouts = dict()
+        self.register(keys, prefixes)
+
+    def register(self, keys=(), prefixes=()):
+        ''' Add keys and key prefixes to the projection '''
+        self.keys.update(keys)
+        self.prefixes = tuple(set(self.prefixes).union(prefixes))
+        self.layouts.clear()
+
+    def wanted(self, layout):
+        ''' The keys of layout (a tuple of document keys) to keep.  Matching
+        900 keys against the prefixes costs as much as the decode, so the
+        result is cached per layout; a thermostat's layout only changes
+        with its firmware. '''
+        wanted = self.layouts.get(layout)
+        if wanted is None:
+            if len(self.layouts) >= MAX_LAYOUTS:
+                self.layouts.clear()
+            wanted = tuple(key for key in layout
+                           if key in self.keys or key.startswith(self.prefixes))
+            self.layouts[layout] = wanted
+        return wanted
+
+    def extract(self, body):
+        ''' Return a dict of the registered keys found in body (bytes) '''
+        document = json.loads(body)
+        return {key: document[key] for key in self.wanted(tuple(document))}
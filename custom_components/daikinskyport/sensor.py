@@ -13,7 +13,7 @@ from homeassistant.components.sensor import (
     SensorEntityDescription,
     SensorStateClass,
 )
-from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.entity import Entity, EntityCategory
 
 from .const import (
     _LOGGER,
@@ -112,8 +112,10 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     if discovery_info is None:
         return
     data = hass.data[DOMAIN]
-    dev = list()
-    for index in range(len(data.daikinskyport.thermostats)):
+
+    def add_sensors(index):
+        """Add the sensors of a thermostat once its data has arrived."""
+        dev = list()
         for sensor in data.daikinskyport.get_sensors(index):
             if sensor["type"] not in ("temperature", "humidity", "score",
                                       "ozone", "particle", "VOC", "demand",
@@ -123,7 +125,11 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
                 
             dev.append(DaikinSkyportSensor(data, sensor["name"], sensor["type"], index))
 
-    add_entities(dev, True)
+        add_entities(dev, True)
+
+    data.add_device_listener(add_sensors)
+    add_entities([DaikinSkyportNetworkSensor(data, endpoint)
+                  for endpoint in data.daikinskyport.network_stats()], True)
 
 
 class DaikinSkyportSensor(SensorEntity):
@@ -133,7 +139,8 @@ class DaikinSkyportSensor(SensorEntity):
         """Initialize the sensor."""
         self.data = data
         self._name = f"{sensor_name} {SENSOR_TYPES[sensor_type]['device_class']}"
-        self._attr_unique_id = f"{data.daikinskyport.thermostats[sensor_index]['id']}-{self._name}"
+        self._device_id = data.daikinskyport.thermostats[sensor_index]['id']
+        self._attr_unique_id = f"{self._device_id}-{self._name}"
         self._sensor_name = sensor_name
         self._type = sensor_type
         self._index = sensor_index
@@ -167,9 +174,37 @@ class DaikinSkyportSensor(SensorEntity):
         """Return the unit of measurement this sensor expresses itself in."""
         return self._native_unit_of_measurement
 
+    @property
+    def extra_state_attributes(self):
+        """Return the age of the data behind the sensor."""
+        return {"data_age": self.data.data_age(self._device_id)}
+
     def update(self):
         """Get the latest state of the sensor."""
         self.data.update()
         for sensor in self.data.daikinskyport.get_sensors(self._index):
             if sensor["type"] == self._type and self._sensor_name == sensor["name"]:
                 self._state = sensor["value"]
+
+
+class DaikinSkyportNetworkSensor(SensorEntity):
+    """Diagnostic sensor counting the API requests made to one endpoint."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+    _attr_icon = "mdi:cloud-sync"
+
+    def __init__(self, data, endpoint):
+        """Initialize the sensor."""
+        self.data = data
+        self._endpoint = endpoint
+        self._attr_name = f"Daikin Skyport {endpoint} requests"
+        self._attr_unique_id = f"daikinskyport-network-{endpoint.replace(' ', '-').lower()}"
+        self._attr_native_value = 0
+        self._attr_extra_state_attributes = {}
+
+    def update(self):
+        """Read the counters; this never calls the API."""
+        stats = self.data.daikinskyport.network_stats()[self._endpoint]
+        self._attr_native_value = stats.pop("requests")
+        self._attr_extra_state_attributes = stats
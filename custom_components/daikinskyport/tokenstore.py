@@ -0,0 +1,126 @@
+''' Token stores used by AsyncDaikinSkyport.
+
+A token store keeps an account's config: EMAIL, optionally PASSWORD, and the
+ACCESS_TOKEN and REFRESH_TOKEN of the last login.  The client loads it once
+at start-up, so a restart reuses valid tokens instead of logging in again,
+and saves new tokens back through it.  Each account gets its own store.'''
+import asyncio
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger('daikinskyport')
+
+# Config keys a store persists after a login.
+TOKEN_FIELDS = ('EMAIL', 'ACCESS_TOKEN', 'REFRESH_TOKEN')
+
+
+def config_from_file(filename, config=None):
+    ''' Small configuration file management function'''
+    if config:
+        # We're writing configuration.  Write a temporary file next to it and
+        # rename it over the old one, so a crash mid-write never leaves a
+        # truncated config behind.
+        directory = os.path.dirname(os.path.abspath(filename))
+        try:
+            fd, temp_name = tempfile.mkstemp(prefix='.daikinskyport-', dir=directory)
+        except IOError as error:
+            logger.exception(error)
+            return False
+        try:
+            with os.fdopen(fd, 'w') as fdesc:
+                fdesc.write(json.dumps(config))
+                fdesc.flush()
+                os.fsync(fdesc.fileno())
+            os.replace(temp_name, filename)
+        except IOError as error:
+            logger.exception(error)
+            os.unlink(temp_name)
+            return False
+        return True
+    else:
+        # We're reading config
+        if os.path.isfile(filename):
+            try:
+                with open(filename, 'r') as fdesc:
+                    return json.loads(fdesc.read())
+            except IOError as error:
+                return False
+        else:
+            return {}
+
+
+class TokenStore(object):
+    ''' Interface for loading and saving an account's config '''
+
+    def load(self):
+        ''' Return the stored config dict (empty if there is none) '''
+        raise NotImplementedError
+
+    async def save(self, config):
+        ''' Store config.  Runs on the client loop; returns True on success '''
+        raise NotImplementedError
+
+
+class FileTokenStore(TokenStore):
+    ''' JSON config file, as written by config_from_file.  Saves run in the
+    default executor so the client loop never blocks on disk I/O. '''
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        return config_from_file(self.filename) or {}
+
+    async def save(self, config):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, config_from_file, self.filename, config)
+
+
+class MemoryTokenStore(TokenStore):
+    ''' Keeps the config in memory only; tokens last until the process exits '''
+
+    def __init__(self, config=None):
+        self.config = dict(config or {})
+
+    def load(self):
+        return dict(self.config)
+
+    async def save(self, config):
+        self.config = dict(config)
+        return True
+
+
+class HomeAssistantTokenStore(TokenStore):
+    ''' Home Assistant helpers.storage.Store living on loop (Home Assistant's
+    event loop).
+
+    credentials (EMAIL and PASSWORD from the configuration) take precedence
+    over what is stored.  While the Store is still empty, the config is
+    loaded from fallback instead, ie an older token file.  load() blocks on
+    loop and must not be called from it.'''
+
+    def __init__(self, store, loop, credentials=None, fallback=None):
+        self.store = store
+        self.loop = loop
+        self.credentials = dict(credentials or {})
+        self.fallback = fallback
+
+    def load(self):
+        config = asyncio.run_coroutine_threadsafe(self.store.async_load(), self.loop).result()
+        if config is None and self.fallback is not None:
+            config = self.fallback.load()
+            # Move the tokens (never the password) over to the Store.
+            tokens = {key: config[key] for key in TOKEN_FIELDS if key in config}
+            if 'REFRESH_TOKEN' in tokens:
+                asyncio.run_coroutine_threadsafe(self.store.async_save(tokens),
+                                                 self.loop).result()
+        config = dict(config or {})
+        config.update(self.credentials)
+        return config
+
+    async def save(self, config):
+        await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self.store.async_save(config), self.loop))
+        return True
@@ -0,0 +1,194 @@
+''' HTTP transports used by AsyncDaikinSkyport.
+
+A transport sends one request and returns a SkyportResponse.  The client only
+talks to the Skyport cloud through this interface, so the live HTTP transport
+can be swapped for the cassette recorder/replayer to benchmark or debug the
+client without network access.'''
+import aiohttp
+import asyncio
+import base64
+import logging
+from json import dumps, loads
+from multidict import CIMultiDict
+from urllib.parse import urlsplit
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger('daikinskyport')
+
+DEFAULT_HEADERS = {'Accept': 'application/json',
+                   'Content-Type': 'application/json;charset=UTF-8'}
+
+# Request fields that are never written to a cassette.
+SCRUBBED_FIELDS = ('password', 'refreshToken')
+
+
+class TransportError(Exception):
+    ''' The request could not be completed (connection error, timeout, ...) '''
+
+
+class SkyportResponse(object):
+    ''' Status, headers and raw body of a completed Skyport API call '''
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return loads(self.body)
+
+
+class Transport(object):
+    ''' Interface for sending Skyport API requests '''
+
+    async def request(self, method, url, headers=None, json=None):
+        ''' Send a request and return a SkyportResponse.
+        Raises TransportError if no response was received. '''
+        raise NotImplementedError
+
+    async def close(self):
+        ''' Release any connections held by the transport '''
+
+
+class AiohttpTransport(Transport):
+    ''' Live HTTP/1.1 transport over a pooled keep-alive aiohttp session '''
+
+    def __init__(self, session=None, pool_size=10, connect_timeout=None, read_timeout=None):
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout,
+                                             sock_read=read_timeout)
+        # A caller-supplied aiohttp session (ie Home Assistant's) is shared and
+        # must not be closed by us.
+        self.session = session
+        self.owns_session = session is None
+
+    def get_session(self):
+        ''' Return the pooled keep-alive session, creating it on first use '''
+        if self.session is None or self.session.closed:
+            # One keep-alive session per account so every poll reuses the same
+            # TLS connections to the API instead of handshaking per request.
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self.owns_session = True
+        return self.session
+
+    async def request(self, method, url, headers=None, json=None):
+        header = dict(DEFAULT_HEADERS)
+        header.update(headers or {})
+        try:
+            async with self.get_session().request(method, url, headers=header, json=json,
+                                                  timeout=self.timeout) as request:
+                return SkyportResponse(request.status, request.headers, await request.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise TransportError(error) from error
+
+    async def close(self):
+        if self.session is not None and self.owns_session:
+            await self.session.close()
+
+
+class HttpxTransport(Transport):
+    ''' Live transport over httpx with HTTP/2 enabled.
+
+    Every device fetch and write for the account is multiplexed over one
+    connection when the server negotiates h2 via ALPN; otherwise httpx
+    falls back to pooled HTTP/1.1 connections on its own.  Needs httpx, and
+    the h2 package for HTTP/2 -- without h2 the transport runs HTTP/1.1.'''
+
+    def __init__(self, pool_size=10, connect_timeout=None, read_timeout=None):
+        if httpx is None:
+            raise ImportError("httpx is required for the HTTP/2 transport")
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        timeout = httpx.Timeout(None, connect=connect_timeout, read=read_timeout)
+        try:
+            self.client = httpx.AsyncClient(http2=True, limits=limits, timeout=timeout,
+                                            headers=DEFAULT_HEADERS)
+        except ImportError:
+            logger.warning("The h2 package is not installed; using HTTP/1.1 for Daikin Skyport.")
+            self.client = httpx.AsyncClient(limits=limits, timeout=timeout,
+                                            headers=DEFAULT_HEADERS)
+        self.http_version = None
+
+    async def request(self, method, url, headers=None, json=None):
+        try:
+            response = await self.client.request(method, url, headers=headers, json=json)
+        except httpx.HTTPError as error:
+            raise TransportError(error) from error
+        if response.http_version != self.http_version:
+            self.http_version = response.http_version
+            logger.debug("Daikin Skyport connection negotiated %s", self.http_version)
+        return SkyportResponse(response.status_code, response.headers, response.content)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class RecordingTransport(Transport):
+    ''' Wraps another transport and appends every exchange to a cassette.
+
+    The cassette is a JSON-lines file, one request/response pair per line.
+    Passwords and refresh tokens in request bodies are scrubbed, but response
+    bodies (including login responses) are stored as received, so treat
+    cassettes as secrets.'''
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.path = path
+
+    async def request(self, method, url, headers=None, json=None):
+        response = await self.transport.request(method, url, headers=headers, json=json)
+        if isinstance(json, dict):
+            json = {key: ('***' if key in SCRUBBED_FIELDS else value)
+                    for key, value in json.items()}
+        exchange = {'method': method,
+                    'path': urlsplit(url).path,
+                    'request': json,
+                    'status': response.status,
+                    'headers': {key: value for key, value in response.headers.items()},
+                    'body': base64.b64encode(response.body).decode('ascii')}
+        with open(self.path, 'a') as fdesc:
+            fdesc.write(dumps(exchange, sort_keys=True) + '\n')
+        return response
+
+    async def close(self):
+        await self.transport.close()
+
+
+class ReplayTransport(Transport):
+    ''' Serves the responses of a recorded cassette back without any network.
+
+    Requests are matched on method and URL path.  Responses for the same
+    request are returned in recorded order; the last one is repeated once
+    they run out, so a short cassette can drive any number of poll cycles.
+    latency is either a number of seconds or a callable returning one, and
+    is awaited before every response to simulate the cloud round trip.'''
+
+    def __init__(self, path, latency=0):
+        self.latency = latency
+        self.exchanges = dict()
+        self.served = dict()
+        with open(path, 'r') as fdesc:
+            for line in fdesc:
+                if not line.strip():
+                    continue
+                exchange = loads(line)
+                key = (exchange['method'], exchange['path'])
+                self.exchanges.setdefault(key, list()).append(exchange)
+
+    async def request(self, method, url, headers=None, json=None):
+        key = (method, urlsplit(url).path)
+        if key not in self.exchanges:
+            raise TransportError('No recorded response for %s %s' % key)
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        exchanges = self.exchanges[key]
+        index = self.served.get(key, 0)
+        self.served[key] = index + 1
+        exchange = exchanges[min(index, len(exchanges) - 1)]
+        return SkyportResponse(exchange['status'], CIMultiDict(exchange['headers']),
+                               base64.b64decode(exchange['body']))
@@ -28,13 +28,14 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     """Set up the Daikin Skyport weather platform."""
     if discovery_info is None:
         return
-    dev = list()
     data = hass.data[DOMAIN]
-    for index in range(len(data.daikinskyport.thermostats)):
+
+    def add_weather(index):
+        """Add the weather entity of a thermostat once its data has arrived."""
         thermostat = data.daikinskyport.get_thermostat(index)
-        dev.append(DaikinSkyportWeather(data,thermostat["name"], index))
+        add_entities([DaikinSkyportWeather(data, thermostat["name"], index)], True)
 
-    add_entities(dev, True)
+    data.add_device_listener(add_weather)
 
 
 class DaikinSkyportWeather(WeatherEntity):
@@ -44,7 +45,8 @@ class DaikinSkyportWeather(WeatherEntity):
         """Initialize the Daikin Skyport weather platform."""
         self.data = data
         self._name = name
-        self._attr_unique_id = f"{data.daikinskyport.thermostats[index]['id']}-{self._name}"
+        self._device_id = data.daikinskyport.thermostats[index]['id']
+        self._attr_unique_id = f"{self._device_id}-{self._name}"
         self._index = index
         self.weather = None
 
@@ -89,6 +91,11 @@ class DaikinSkyportWeather(WeatherEntity):
         except ValueError:
             return None
 
+    @property
+    def extra_state_attributes(self):
+        """Return the age of the weather data."""
+        return {"data_age": self.data.data_age(self._device_id)}
+
     @property
     def forecast(self):
         """Return the forecast array."""